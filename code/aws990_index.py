@@ -0,0 +1,190 @@
+#########################################
+#
+# aws990_index.py
+#----------------------------------
+#
+# Command line entry point that runs each step of an index update on its own.
+# - list: retrieve the file manifest from AWS and split it by year
+# - diff: find the object IDs that are new or re-uploaded since the last update
+# - fetch: read those forms from AWS
+# - merge: add the forms read to the comprehensive index as a delta
+# - compact: fold the deltas into a new base file
+# - query: look up rows in the comprehensive index
+#
+#----------------------------------
+#
+# Notes: Each command imports only the libraries it needs once it runs, so diff and query
+# don't wait on boto3 or irsx.
+# Paths that differ by year take a {yr} placeholder, e.g. file_list_{yr}.csv
+#
+#########################################
+
+# Libraries
+import argparse
+import datetime
+import sys
+
+# Constants
+BEGIN_YR = 2009
+END_YR = 2019
+RUN_ID_FMT = "%Y%m%d%H%M%S"
+
+
+#########################################
+# Commands
+#########################################
+
+def yr_lst( args ):
+    return list( range( args.begin_yr, args.end_yr + 1 ) )
+
+def prev_comp_filename( args, yr ):
+    return args.prev_comp.format( yr=yr ) if args.prev_comp else None
+
+# Retrieve the manifest of all files on AWS
+def run_list( args ):
+    from updating_comprehensive_aws_index import retrieve_filenames
+
+    # The combined file list drops the year from the manifest name
+    if args.manifest.count( "{yr}" ) != 1:
+        sys.exit( "--manifest must contain {yr} exactly once" )
+    oid_file_pref, oid_file_suff = args.manifest.split( "{yr}" )
+    retrieve_filenames( args.begin_yr, args.end_yr, oid_file_pref, oid_file_suff )
+
+# Save the object IDs that need to be read for each year
+def run_diff( args ):
+    import pandas as pd
+    from updating_comprehensive_aws_index import IND_FILE_OID_COL, read_cur_ind, find_oids_to_fetch
+
+    for yr in yr_lst( args ):
+        cur_ind_file = read_cur_ind( yr, args.cur_ind.format( yr=yr ), args.comp_dir, prev_comp_filename( args, yr ),
+                                     save_seed=False )
+        prev_oid_filename = args.prev_manifest.format( yr=yr ) if args.prev_manifest else None
+        oid_srch_lst = find_oids_to_fetch( yr, cur_ind_file, args.manifest.format( yr=yr ), prev_oid_filename )
+        pd.DataFrame( {IND_FILE_OID_COL: oid_srch_lst} ).to_csv( args.fetch_list.format( yr=yr ), index=False )
+
+# Read the forms listed by diff and save their index rows
+def run_fetch( args ):
+    import pandas as pd
+    from index_deltas import IND_FILE_OID_COL, read_ind_csv
+    from updating_comprehensive_aws_index import fetch_yr_ind
+
+    for yr in yr_lst( args ):
+        oid_srch_lst = read_ind_csv( args.fetch_list.format( yr=yr ) )[IND_FILE_OID_COL].tolist()
+        if len( oid_srch_lst ) > 0:
+            yr_ind_new = fetch_yr_ind( oid_srch_lst )
+        else:
+            yr_ind_new = pd.DataFrame( columns=[IND_FILE_OID_COL] )
+        yr_ind_new.to_csv( args.fetched.format( yr=yr ), index=False )
+
+# Add the fetched rows to the comprehensive index, all years share one run ID
+def run_merge( args ):
+    from index_deltas import new_run_id, read_ind_csv
+    from updating_comprehensive_aws_index import read_cur_ind, merge_yr_ind
+
+    run_id = args.run_id if args.run_id else new_run_id()
+    for yr in yr_lst( args ):
+        cur_ind_file = read_cur_ind( yr, args.cur_ind.format( yr=yr ), args.comp_dir, prev_comp_filename( args, yr ) )
+        merge_yr_ind( yr, cur_ind_file, read_ind_csv( args.fetched.format( yr=yr ) ), args.comp_dir, run_id )
+
+def run_compact( args ):
+    from index_deltas import compact_comp_index
+
+    for yr in yr_lst( args ):
+        compact_comp_index( args.comp_dir, yr )
+
+# Print the matching rows of the comprehensive index as csv
+def run_query( args ):
+    import pandas as pd
+    from index_deltas import IND_FILE_OID_COL, read_comp_index
+
+    comp_ind = pd.concat( [read_comp_index( args.comp_dir, yr ) for yr in yr_lst( args )], ignore_index=True )
+    if args.oid:
+        comp_ind = comp_ind[comp_ind[IND_FILE_OID_COL].isin( args.oid )]
+    if args.ein:
+        # Years without an index yet have no EIN column, so nothing can match
+        if 'EIN' in comp_ind.columns:
+            comp_ind = comp_ind[comp_ind['EIN'].isin( args.ein )]
+        else:
+            comp_ind = comp_ind.iloc[0:0]
+    comp_ind.to_csv( sys.stdout, index=False )
+
+
+#########################################
+# Arguments
+#########################################
+
+# Deltas are applied in the sorted order of their run IDs, so they must be timestamps like new_run_id gives
+def run_id_arg( run_id ):
+    try:
+        if len( run_id ) != 14:
+            raise ValueError
+        datetime.datetime.strptime( run_id, RUN_ID_FMT )
+    except ValueError:
+        raise argparse.ArgumentTypeError( "run ID must be a timestamp formatted as YYYYMMDDHHMMSS" )
+    return run_id
+
+def build_parser():
+    parser = argparse.ArgumentParser( prog="aws990-index", description="Build and read the comprehensive AWS 990 index." )
+    subparsers = parser.add_subparsers( dest="command", required=True )
+
+    # Every command works on a range of years
+    yr_parser = argparse.ArgumentParser( add_help=False )
+    yr_parser.add_argument( "--begin-yr", type=int, default=BEGIN_YR )
+    yr_parser.add_argument( "--end-yr", type=int, default=END_YR )
+
+    # Arguments shared by the commands that read the comprehensive index
+    comp_parser = argparse.ArgumentParser( add_help=False )
+    comp_parser.add_argument( "--comp-dir", default=".", help="directory of the comprehensive index base and delta files" )
+
+    # Arguments shared by the commands that combine the AWS provided index with the comprehensive index
+    cur_parser = argparse.ArgumentParser( add_help=False )
+    cur_parser.add_argument( "--cur-ind", default="index_{yr}.csv", help="index file provided by AWS" )
+    cur_parser.add_argument( "--prev-comp", help="full index saved before deltas were used, read for years without a base. "
+                                                 "merge saves it as their base, diff doesn't write any files to --comp-dir" )
+
+    list_parser = subparsers.add_parser( "list", parents=[yr_parser], help="retrieve the file manifest from AWS" )
+    list_parser.add_argument( "--manifest", default="file_list_{yr}.csv" )
+    list_parser.set_defaults( func=run_list )
+
+    diff_parser = subparsers.add_parser( "diff", parents=[yr_parser, comp_parser, cur_parser],
+                                         help="find the object IDs that are new or re-uploaded" )
+    diff_parser.add_argument( "--manifest", default="file_list_{yr}.csv" )
+    diff_parser.add_argument( "--prev-manifest", help="manifest from the last update, used to detect re-uploaded forms" )
+    diff_parser.add_argument( "--fetch-list", default="fetch_list_{yr}.csv" )
+    diff_parser.set_defaults( func=run_diff )
+
+    fetch_parser = subparsers.add_parser( "fetch", parents=[yr_parser], help="read the forms found by diff" )
+    fetch_parser.add_argument( "--fetch-list", default="fetch_list_{yr}.csv" )
+    fetch_parser.add_argument( "--fetched", default="fetched_{yr}.csv" )
+    fetch_parser.set_defaults( func=run_fetch )
+
+    merge_parser = subparsers.add_parser( "merge", parents=[yr_parser, comp_parser, cur_parser],
+                                          help="add the fetched forms to the comprehensive index as a delta" )
+    merge_parser.add_argument( "--fetched", default="fetched_{yr}.csv" )
+    merge_parser.add_argument( "--run-id", type=run_id_arg, help="YYYYMMDDHHMMSS timestamp, defaults to the current time" )
+    merge_parser.set_defaults( func=run_merge )
+
+    compact_parser = subparsers.add_parser( "compact", parents=[yr_parser, comp_parser],
+                                            help="fold the deltas into a new base file" )
+    compact_parser.set_defaults( func=run_compact )
+
+    query_parser = subparsers.add_parser( "query", parents=[yr_parser, comp_parser],
+                                          help="print rows of the comprehensive index" )
+    query_parser.add_argument( "--oid", nargs="+", help="object IDs to match" )
+    query_parser.add_argument( "--ein", nargs="+", help="EINs to match" )
+    query_parser.set_defaults( func=run_query )
+
+    return parser
+
+
+#########################################
+# MAIN
+#########################################
+
+def main( argv=None ):
+    args = build_parser().parse_args( argv )
+    args.func( args )
+
+
+if __name__ == '__main__':
+    main()
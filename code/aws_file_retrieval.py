@@ -41,8 +41,9 @@ def get_keys_for_prefix(prefix):
         if "Contents" not in page:
             continue
         
-        # You could also capture, e.g., the timestamp or checksum here
-        page_keys = (element["Key"] for element in page["Contents"])
+        # Keep the checksum, size and timestamp for change detection. AWS wraps the ETag in quotes.
+        page_keys = ((element["Key"], element["ETag"].strip('"'), element["Size"],
+                      element["LastModified"].isoformat()) for element in page["Contents"])
         results.extend(page_keys)
     logging.info("Scanned {} page(s) with prefix {}.".format(i+1, prefix))
     return results
@@ -65,13 +66,13 @@ if __name__ == '__main__':
     for future in as_completed(futures):
         keys = future.result()
         for key in keys:
-            file_lst.append( str( key ) )
+            file_lst.append( [str( val ) for val in key] )
             n += 1
 
     with open( 'file_list.csv', 'w' ) as f:
-        f.write( "file_name\n" )
-        for filename in file_lst:
-            f.write( filename + '\n' )
+        f.write( "file_name,etag,size,last_modified\n" )
+        for file_info in file_lst:
+            f.write( ",".join( file_info ) + '\n' )
 
     elapsed = time.time() - start
     logging.info("Discovered {:,} keys in {:,.1f} seconds.".format(n, elapsed))
@@ -27,7 +27,7 @@
 # Libraries
 import pandas as pd
 import re
-from irsx.xmlrunner import XMLRunner
+# irsx and requests are slow to import so they are imported by the functions that use them
 
 # Constants
 # - File names are assumed to include the year as text at some point in the name
@@ -119,6 +119,7 @@ def manu_fetch_name( form_990 ):
 # Fetch file directly from AWS.
 # Sometimes the request raises an error but still works well enough so there are two try statements
 def manu_fetch_file( oid ):
+    import requests
     try:
         url = 'https://s3.amazonaws.com/irs-form-990/' + oid + '_public.xml'
         r = requests.get( url, allow_redirects=True )
@@ -205,14 +206,18 @@ def fetch_yr_ind( oid_srch_lst ):
     # Should we use IRSx or manual concordance? Setup IRSx if using it
     # Requires all object IDs in the file to be from the same year
     irsx_flag = True if int( oid_srch_lst[0][:4] ) >= 2015 else False
+    if irsx_flag:
+        from irsx.xmlrunner import XMLRunner
     xml_runner = XMLRunner() if irsx_flag else None
         
-    yr_ind_new = pd.DataFrame()
+    # Collect the rows and combine them once at the end
+    ind_rows = []
     
     # Iterate through Object IDs
     for oid in oid_srch_lst:
-        yr_ind_new = yr_ind_new.append( fetch_ind_row( irsx_flag, xml_runner, oid ) )
+        ind_rows.append( fetch_ind_row( irsx_flag, xml_runner, oid ) )
     
+    yr_ind_new = pd.concat( ind_rows )
     yr_ind_new['990_SRC'] = "AWS FILE DIR"
     
     return yr_ind_new
@@ -224,35 +229,33 @@ def fetch_yr_ind( oid_srch_lst ):
 #########################################
 
 
-# Iterate through all years
-yr_lst = list( range( BEGIN_YR, END_YR + 1 ) )
-for yr in yr_lst:
-    
-    # Read up-to-date index file if one exists, at time of writing 2009 and 2010 dont exist
-    try:
-        cur_ind_file = pd.read_csv( CUR_IND_FILE_PREF + str( yr ) + CUR_IND_FILE_SUFF )
-        cur_ind_file['990_SRC'] = "AWS INDEX"
-    except:
-        cur_ind_file = pd.DataFrame( columns=[IND_FILE_OID_COL] )
-    
-    # Read new file list taken from aws_file_retrieval.py and make object ID column
-    new_oid_file = pd.read_csv( NEW_OID_FILE_PREF + str( yr ) + NEW_OID_FILE_SUFF, usecols=[NEW_OID_FILE_COL] )
-    new_oid_file[IND_FILE_OID_COL] = new_oid_file[NEW_OID_FILE_COL].str[:18]
-    
-    # Determine the object IDs to read
-    oid_srch_lst = new_oid_file[~new_oid_file[IND_FILE_OID_COL].isin( cur_ind_file[IND_FILE_OID_COL] )]
-    oid_srch_lst = oid_srch_lst[IND_FILE_OID_COL].tolist()
-    
-    print( "Read in " + str( yr ) + " files. Reading " + str( len( oid_srch_lst ) ) + " Object IDs." )
-    
-    # Fetch the information for the new index file and append it to the current one
-    cur_ind_file = cur_ind_file.append( fetch_yr_ind( oid_srch_lst ) )
-    
-    # Save and print progress    
-    cur_ind_file.to_csv( NEW_IND_FILE_PREF + str( yr ) + NEW_IND_FILE_SUFF, index=False )
-    print( "Done with " + str( yr ) + " file." )
-print( "Completed." )
+if __name__ == '__main__':
+
+    # Iterate through all years
+    yr_lst = list( range( BEGIN_YR, END_YR + 1 ) )
+    for yr in yr_lst:
+
+        # Read up-to-date index file if one exists, at time of writing 2009 and 2010 dont exist
+        try:
+            cur_ind_file = pd.read_csv( CUR_IND_FILE_PREF + str( yr ) + CUR_IND_FILE_SUFF )
+            cur_ind_file['990_SRC'] = "AWS INDEX"
+        except:
+            cur_ind_file = pd.DataFrame( columns=[IND_FILE_OID_COL] )
+
+        # Read new file list taken from aws_file_retrieval.py and make object ID column
+        new_oid_file = pd.read_csv( NEW_OID_FILE_PREF + str( yr ) + NEW_OID_FILE_SUFF, usecols=[NEW_OID_FILE_COL] )
+        new_oid_file[IND_FILE_OID_COL] = new_oid_file[NEW_OID_FILE_COL].str[:18]
 
+        # Determine the object IDs to read
+        oid_srch_lst = new_oid_file[~new_oid_file[IND_FILE_OID_COL].isin( cur_ind_file[IND_FILE_OID_COL] )]
+        oid_srch_lst = oid_srch_lst[IND_FILE_OID_COL].tolist()
 
+        print( "Read in " + str( yr ) + " files. Reading " + str( len( oid_srch_lst ) ) + " Object IDs." )
 
+        # Fetch the information for the new index file and append it to the current one
+        cur_ind_file = pd.concat( [cur_ind_file, fetch_yr_ind( oid_srch_lst )] )
 
+        # Save and print progress    
+        cur_ind_file.to_csv( NEW_IND_FILE_PREF + str( yr ) + NEW_IND_FILE_SUFF, index=False )
+        print( "Done with " + str( yr ) + " file." )
+    print( "Completed." )
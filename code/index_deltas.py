@@ -0,0 +1,162 @@
+#########################################
+#
+# index_deltas.py
+#----------------------------------
+#
+# Stores the comprehensive index for each year as a base snapshot plus one delta file per
+# update. A delta holds the rows added, removed or changed by that update keyed by Object ID
+# and stamped with the update's run ID. Reading the index applies the deltas to the base in
+# run order and compacting folds them into a new base snapshot.
+#
+#----------------------------------
+#
+# Notes: Run this script directly to compact every year's deltas into its base snapshot.
+# All columns are read as text so that values compare the same before and after saving.
+#
+#########################################
+
+# Libraries
+import os
+import glob
+import datetime
+import logging
+import pandas as pd
+
+# Constants
+# - Base file is the snapshot the deltas apply to, file names include the year
+# - Delta files also include the run ID, which sorts in the order the updates were run
+IND_FILE_OID_COL = "OBJECT_ID"
+COMP_DIR = "."
+COMP_FILE_PREF = "all_file_index_new_"
+COMP_FILE_SUFF = ".csv"
+DELTA_FILE_PREF = "all_file_index_delta_"
+DELTA_FILE_SUFF = ".csv"
+DELTA_CHANGE_COL = "CHANGE"
+DELTA_RUN_COL = "RUN_ID"
+BEGIN_YR = 2009
+END_YR = 2019
+
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+
+#########################################
+# File names
+#########################################
+
+# Run IDs are timestamps so that delta file names sort in run order
+def new_run_id():
+    return datetime.datetime.now().strftime( "%Y%m%d%H%M%S" )
+
+def base_filename( comp_dir, yr ):
+    return os.path.join( comp_dir, COMP_FILE_PREF + str( yr ) + COMP_FILE_SUFF )
+
+def delta_filename( comp_dir, yr, run_id ):
+    return os.path.join( comp_dir, DELTA_FILE_PREF + str( yr ) + "_" + run_id + DELTA_FILE_SUFF )
+
+# All delta files for a year in run order
+def delta_filenames( comp_dir, yr ):
+    return sorted( glob.glob( delta_filename( comp_dir, yr, "*" ) ) )
+
+def has_comp_index( comp_dir, yr ):
+    return os.path.exists( base_filename( comp_dir, yr ) ) or len( delta_filenames( comp_dir, yr ) ) > 0
+
+
+#########################################
+# Reading
+#########################################
+
+def read_ind_csv( filename ):
+    return pd.read_csv( filename, dtype=str, keep_default_na=False )
+
+# Read the base snapshot and apply each delta on top of it
+def read_comp_index( comp_dir, yr ):
+    try:
+        comp_ind = read_ind_csv( base_filename( comp_dir, yr ) )
+    except FileNotFoundError:
+        comp_ind = pd.DataFrame( columns=[IND_FILE_OID_COL] )
+
+    # Every row in a delta replaces the row with the same Object ID, removed rows aren't added back
+    for filename in delta_filenames( comp_dir, yr ):
+        delta = read_ind_csv( filename )
+        comp_ind = comp_ind[~comp_ind[IND_FILE_OID_COL].isin( delta[IND_FILE_OID_COL] )]
+        delta = delta[delta[DELTA_CHANGE_COL] != "removed"].drop( columns=[DELTA_CHANGE_COL, DELTA_RUN_COL] )
+        comp_ind = pd.concat( [comp_ind, delta], ignore_index=True )
+
+    return comp_ind.fillna( '' )
+
+
+#########################################
+# Writing
+#########################################
+
+# Find the rows added, removed and changed between two versions of an index
+def diff_comp_index( old_ind, new_ind, run_id ):
+
+    # Line both versions up on the same columns and Object IDs, compare everything as text
+    cols = list( dict.fromkeys( list( new_ind.columns ) + list( old_ind.columns ) ) )
+    old_ind = old_ind.reindex( columns=cols ).fillna( '' ).astype( str )
+    new_ind = new_ind.reindex( columns=cols ).fillna( '' ).astype( str )
+    old_ind = old_ind.drop_duplicates( IND_FILE_OID_COL, keep='last' ).set_index( IND_FILE_OID_COL, drop=False )
+    new_ind = new_ind.drop_duplicates( IND_FILE_OID_COL, keep='last' ).set_index( IND_FILE_OID_COL, drop=False )
+
+    added = new_ind[~new_ind.index.isin( old_ind.index )]
+    removed = old_ind[~old_ind.index.isin( new_ind.index )]
+    both = new_ind.index.intersection( old_ind.index )
+    changed = new_ind.loc[both][( new_ind.loc[both] != old_ind.loc[both] ).any( axis=1 )]
+
+    delta = pd.concat( [added.assign( **{DELTA_CHANGE_COL: "added"} ),
+                        removed.assign( **{DELTA_CHANGE_COL: "removed"} ),
+                        changed.assign( **{DELTA_CHANGE_COL: "changed"} )], ignore_index=True )
+    delta[DELTA_RUN_COL] = run_id
+
+    return delta
+
+# Save a full index as the base for a year
+def save_base_index( new_ind, comp_dir, yr ):
+    os.makedirs( comp_dir, exist_ok=True )
+    new_ind.to_csv( base_filename( comp_dir, yr ), index=False )
+    logging.info( "Saved {} rows as the base index for {}".format( len( new_ind ), yr ) )
+
+# Save an updated index as a delta against the current one. The first save for a year is the base.
+def save_comp_index( new_ind, comp_dir, yr, run_id ):
+
+    if not has_comp_index( comp_dir, yr ):
+        save_base_index( new_ind, comp_dir, yr )
+        return
+
+    delta = diff_comp_index( read_comp_index( comp_dir, yr ), new_ind, run_id )
+    if len( delta ) == 0:
+        logging.info( "No changes to the {} index".format( yr ) )
+        return
+
+    delta.to_csv( delta_filename( comp_dir, yr, run_id ), index=False )
+    logging.info( "Saved {} changed rows for {} in run {}".format( len( delta ), yr, run_id ) )
+
+# Fold all deltas for a year into a new base snapshot and remove them
+def compact_comp_index( comp_dir, yr ):
+
+    filenames = delta_filenames( comp_dir, yr )
+    if not filenames:
+        return
+
+    # Write to a temporary file first so an interrupted compaction leaves the old base and deltas intact
+    comp_ind = read_comp_index( comp_dir, yr )
+    tmp_filename = base_filename( comp_dir, yr ) + ".tmp"
+    comp_ind.to_csv( tmp_filename, index=False )
+    os.replace( tmp_filename, base_filename( comp_dir, yr ) )
+    for filename in filenames:
+        os.remove( filename )
+
+    logging.info( "Compacted {} deltas into the {} base index".format( len( filenames ), yr ) )
+
+
+#########################################
+# MAIN
+#########################################
+
+
+if __name__ == '__main__':
+
+    for yr in range( BEGIN_YR, END_YR + 1 ):
+        compact_comp_index( COMP_DIR, yr )
+    logging.info( "Completed." )
@@ -30,36 +30,46 @@ import re
 import time
 import datetime
 import logging
-from irsx.xmlrunner import XMLRunner
-import requests
+import os
+import threading
 from collections import deque
 from typing import List, Deque, Iterable, Dict
-import boto3
-from botocore.config import Config
-from botocore import UNSIGNED
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, Future
+from index_deltas import new_run_id, has_comp_index, read_ind_csv, read_comp_index, save_base_index, save_comp_index
+# boto3, irsx and requests are slow to import so they are imported by the functions that use them.
+# This lets aws990_index.py commands that only compare or read index files start quickly.
 
 # Constants
 # - File names are assumed to include the year as text at some point in the name
 # - Current index file is assumed to be the index file downloaded from AWS, but this is flexible.
-# - Current comprehensive file is the file most recently created
-# - New OID file is an intermediate file created with the full list of available forms.
-# - New index file is what you want to save it as
+# - Comprehensive directory holds the index created by this script, saved as a base file plus
+#	a delta file for each update (see index_deltas.py)
+# - Previous comprehensive file is the full index saved before deltas were used. It becomes the
+#	base file for any year that doesn't have one yet
+# - New OID file is an intermediate file created with the full list of available forms. It doubles
+#	as a manifest holding each form's ETag, size and last modified time as reported by AWS.
+# - Previous OID file is the manifest saved by the last update, used to detect re-uploaded forms
 CUR_IND_FILE_PREF = "index_"
 CUR_IND_FILE_SUFF = ".csv"
 IND_FILE_OID_COL = "OBJECT_ID"
-CUR_COMP_FILE_PREF = "../202108 Update/all_file_index_new_"
-CUR_COMP_FILE_SUFF = "2108.csv"
+COMP_DIR = "."
+PREV_COMP_FILE_PREF = "../202108 Update/all_file_index_new_"
+PREV_COMP_FILE_SUFF = "2108.csv"
 NEW_OID_FILE_PREF = "file_list_"
 NEW_OID_FILE_SUFF = "2110.csv"
 NEW_OID_FILE_COL = "file_name"
-NEW_IND_FILE_PREF = "all_file_index_new_"
-NEW_IND_FILE_SUFF = "2110.csv"
+MANIFEST_ETAG_COL = "etag"
+MANIFEST_SIZE_COL = "size"
+MANIFEST_MOD_COL = "last_modified"
+MANIFEST_COLS = [NEW_OID_FILE_COL, MANIFEST_ETAG_COL, MANIFEST_SIZE_COL, MANIFEST_MOD_COL]
+PREV_OID_FILE_PREF = "../202108 Update/file_list_"
+PREV_OID_FILE_SUFF = "2108.csv"
 AWS_BUCKET = "irs-form-990"
 BEGIN_YR = 2009
 END_YR = 2019
 
 upd_intvl = 1000 # Frequency you want it to update you on progress in number of forms
+fetch_workers = 16 # Number of forms read from AWS at the same time
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
 
@@ -79,12 +89,11 @@ FILENAMES_NEEDED = True
 # File List Retrieval
 #########################################
 
-# The prefices in the AWS file system
-first_prefix = BEGIN_YR * 100
-last_prefix = (END_YR + 1) * 100
-
 # Finds the page keys given the prefix
 def get_keys_for_prefix(prefix):
+    import boto3
+    from botocore.config import Config
+    from botocore import UNSIGNED
 
     my_config = Config( region_name = 'us-east-1', signature_version=UNSIGNED )
     client = boto3.client('s3', config=my_config)
@@ -100,25 +109,31 @@ def get_keys_for_prefix(prefix):
         if "Contents" not in page:
             continue
         
-        # You could also capture, e.g., the timestamp or checksum here
-        page_keys = (element["Key"] for element in page["Contents"])
+        # Keep the checksum, size and timestamp so updates can skip unchanged forms
+        # and read the largest forms first. AWS wraps the ETag in quotes.
+        page_keys = ( ( element["Key"], element["ETag"].strip( '"' ), element["Size"],
+                        element["LastModified"].isoformat() ) for element in page["Contents"] )
         results.extend(page_keys)
     if ( int( prefix ) % 100 ) == 0:
     	logging.info( "Scanning pages from {}.".format( prefix[:4] ) )
     return results
 
 # The main script just saves one large file. This breaks it up by year which is probably more useful
-def sep_files_by_yr(full_filename):
+def sep_files_by_yr( full_filename, begin_yr, end_yr, oid_file_pref, oid_file_suff ):
     file_list = pd.read_csv( full_filename )
-    yr_lst = list( range( BEGIN_YR, END_YR + 1 ) )
+    yr_lst = list( range( begin_yr, end_yr + 1 ) )
     for yr in yr_lst:
-        save_filename = NEW_OID_FILE_PREF + str( yr ) + NEW_OID_FILE_SUFF
+        save_filename = oid_file_pref + str( yr ) + oid_file_suff
         file_list[ file_list['file_name'].str.startswith( str( yr ) ) ].to_csv( save_filename, index=False )
 
 # Retrieve all file names and save them in a csv
-def retrieve_filenames():
+def retrieve_filenames( begin_yr=BEGIN_YR, end_yr=END_YR, oid_file_pref=NEW_OID_FILE_PREF, oid_file_suff=NEW_OID_FILE_SUFF ):
     start = time.time()
-    res_filename = NEW_OID_FILE_PREF + NEW_OID_FILE_SUFF
+    res_filename = oid_file_pref + oid_file_suff
+
+    # The prefices in the AWS file system
+    first_prefix = begin_yr * 100
+    last_prefix = (end_yr + 1) * 100
 
     # ProcessPoolExecutor starts a completely separate copy of Python for each worker
     with ProcessPoolExecutor() as executor:
@@ -134,18 +149,18 @@ def retrieve_filenames():
     for future in as_completed(futures):
         keys = future.result()
         for key in keys:
-            file_lst.append( str( key ) )
+            file_lst.append( [str( val ) for val in key] )
             n += 1
 
     with open( res_filename, 'w' ) as f: 
-        f.write( "file_name\n" )
-        for filename in file_lst:
-            f.write( filename + '\n' )
+        f.write( ",".join( MANIFEST_COLS ) + "\n" )
+        for file_info in file_lst:
+            f.write( ",".join( file_info ) + '\n' )
 
     elapsed = time.time() - start
     logging.info("Discovered {:,} keys in {:,.1f} seconds.".format(n, elapsed))
 
-    sep_files_by_yr( res_filename )
+    sep_files_by_yr( res_filename, begin_yr, end_yr, oid_file_pref, oid_file_suff )
 
 #########################################
 # Form Fetch: 
@@ -216,6 +231,7 @@ def manu_fetch_name( form_990 ):
 # Fetch file directly from AWS.
 # Sometimes the request raises an error but still works well enough so there are two try statements
 def manu_fetch_file( oid ):
+    import requests
     try:
         url = 'https://s3.amazonaws.com/irs-form-990/' + oid + '_public.xml'
         r = requests.get( url, allow_redirects=True )
@@ -301,74 +317,139 @@ def fetch_yr_ind( oid_srch_lst ):
     # Should we use IRSx or manual concordance? Setup IRSx if using it
     # Requires all object IDs in the file to be from the same year
     irsx_flag = True if int( oid_srch_lst[0][:4] ) >= 2015 else False
-    xml_runner = XMLRunner() if irsx_flag else None
-        
-    yr_ind_new = pd.DataFrame()
-    
-    # Iterate through Object IDs and update regularly
+    if irsx_flag:
+        from irsx.xmlrunner import XMLRunner
+
+    # Each thread gets its own XMLRunner so threads don't share one parser
+    thread_data = threading.local()
+    def fetch_oid_row( oid ):
+        if irsx_flag and not hasattr( thread_data, 'xml_runner' ):
+            thread_data.xml_runner = XMLRunner()
+        return fetch_ind_row( irsx_flag, getattr( thread_data, 'xml_runner', None ), oid )
+
+    # Read forms in parallel and update regularly. Forms are submitted in the order given,
+    # so when the largest forms come first they don't leave one slow form at the end of the run
     start_time = time.time()
-    counter = 0
-    for oid in oid_srch_lst:
-        yr_ind_new = yr_ind_new.append( fetch_ind_row( irsx_flag, xml_runner, oid ) )
-        if counter % upd_intvl == 0:
-            elapsed = time.time() - start_time
-            logging.info( "Read {} forms from current year in {:,.1f} seconds.".format( counter, elapsed ) )
-        counter += 1
-    
+    with ThreadPoolExecutor( max_workers=fetch_workers ) as executor:
+        futures = [executor.submit( fetch_oid_row, oid ) for oid in oid_srch_lst]
+        for counter, future in enumerate( as_completed( futures ) ):
+            if counter % upd_intvl == 0:
+                elapsed = time.time() - start_time
+                logging.info( "Read {} forms from current year in {:,.1f} seconds.".format( counter, elapsed ) )
+
+    # Combine the rows once at the end, keeping the order of the Object IDs
+    yr_ind_new = pd.concat( [future.result() for future in futures] )
     yr_ind_new['990_SRC'] = "AWS FILE DIR"
     
     return yr_ind_new
 
 
 #########################################
-# MAIN
+# Index Update:
+# Each step of an update reads and saves files for one year so they can be run separately
 #########################################
 
+# Combine the AWS provided index with the comprehensive index from the last update
+def read_cur_ind( yr, cur_ind_filename, comp_dir, prev_comp_filename=None, save_seed=True ):
 
-if __name__ == '__main__':
+    # Read up-to-date index file if one exists, at time of writing 2009 and 2010 dont exist
+    try:
+        cur_ind_file = read_ind_csv( cur_ind_filename )
+        cur_ind_file['990_SRC'] = "AWS INDEX"
+    except:
+        cur_ind_file = pd.DataFrame( columns=[IND_FILE_OID_COL] )
+
+    # Read the comprehensive index as of the last update, its base file with any deltas applied
+    # A year without one starts from the full index saved before deltas were used, if given
+    # This will read in all the new files for a year that hasn't been updated yet
+    seeding = False
+    if prev_comp_filename and not has_comp_index( comp_dir, yr ) and os.path.exists( prev_comp_filename ):
+        cur_comp_file = read_ind_csv( prev_comp_filename )
+        seeding = True
+    else:
+        cur_comp_file = read_comp_index( comp_dir, yr )
 
-	if FILENAMES_NEEDED:
-		retrieve_filenames()
+    # Replace entries that we had previously retrieved manually that are now in the official AWS index
+    cur_comp_file = cur_comp_file[~cur_comp_file[IND_FILE_OID_COL].isin( cur_ind_file[IND_FILE_OID_COL] )]
+    cur_ind_file = pd.concat( [cur_ind_file, cur_comp_file], ignore_index=True )
 
-	# Iterate through all years
-	yr_lst = list( range( BEGIN_YR, END_YR + 1 ) )
-	for yr in yr_lst:
+    # Save the seeded index as the base rather than copying the previous file. The previous file's
+    # values were written with inferred types (Ex. 1.0 for 1), so the first delta would hold every row.
+    # Read-only steps such as diff turn off save_seed and only use the seeded index in memory.
+    if seeding and save_seed:
+        save_base_index( cur_ind_file, comp_dir, yr )
+        logging.info( "Seeded the {} base index from {}".format( yr, prev_comp_filename ) )
 
-		# Read up-to-date index file if one exists, at time of writing 2009 and 2010 dont exist
-		try:
-			cur_ind_file = pd.read_csv( CUR_IND_FILE_PREF + str( yr ) + CUR_IND_FILE_SUFF )
-			cur_ind_file['990_SRC'] = "AWS INDEX"
-		except:
-			cur_ind_file = pd.DataFrame( columns=[IND_FILE_OID_COL] )
+    return cur_ind_file
 
-		# Read most recent comprehensive AWS index file extracting files not in the current AWS-provided file
-		# This will read in all the new files for a year that hasn't been updated yet
-		try:
-			cur_comp_file = pd.read_csv( CUR_COMP_FILE_PREF + str( yr ) + CUR_COMP_FILE_SUFF )
-		except:
-			cur_comp_file = pd.DataFrame( columns=[IND_FILE_OID_COL] )
+# Determine the object IDs that are new or re-uploaded, largest forms first
+def find_oids_to_fetch( yr, cur_ind_file, new_oid_filename, prev_oid_filename ):
 
-		# Replace entries that we had previously retrieved manually that are now in the official AWS index
-		cur_comp_file = cur_comp_file[~cur_comp_file[IND_FILE_OID_COL].isin( cur_ind_file[IND_FILE_OID_COL] )]
-		cur_ind_file = cur_ind_file.append( cur_comp_file )
+    # Read new file manifest and make object ID column
+    new_oid_file = pd.read_csv( new_oid_filename, usecols=MANIFEST_COLS )
+    new_oid_file[IND_FILE_OID_COL] = new_oid_file[NEW_OID_FILE_COL].str[:18]
 
-		# Read new file list taken from aws_file_retrieval.py and make object ID column
-		new_oid_file = pd.read_csv( NEW_OID_FILE_PREF + str( yr ) + NEW_OID_FILE_SUFF, usecols=[NEW_OID_FILE_COL] )
-		new_oid_file[IND_FILE_OID_COL] = new_oid_file[NEW_OID_FILE_COL].str[:18].astype( int )
+    # Read the manifest from the last update. Older file lists without ETags can't detect re-uploads
+    try:
+        prev_oid_file = pd.read_csv( prev_oid_filename, usecols=[NEW_OID_FILE_COL, MANIFEST_ETAG_COL] )
+        prev_oid_file[IND_FILE_OID_COL] = prev_oid_file[NEW_OID_FILE_COL].str[:18]
+    except:
+        prev_oid_file = pd.DataFrame( columns=[IND_FILE_OID_COL, MANIFEST_ETAG_COL] )
+
+    # Forms whose ETag changed since the last manifest were re-uploaded and are read again.
+    # Unchanged forms already in the index are skipped. Forms in the AWS provided index keep
+    # their row from it, which has more information than reading the form gives.
+    reupl_oids = new_oid_file[[IND_FILE_OID_COL, MANIFEST_ETAG_COL]].merge(
+        prev_oid_file[[IND_FILE_OID_COL, MANIFEST_ETAG_COL]], on=IND_FILE_OID_COL, suffixes=( '', '_prev' ) )
+    reupl_oids = reupl_oids[reupl_oids[MANIFEST_ETAG_COL] != reupl_oids[MANIFEST_ETAG_COL + '_prev']]
+    if '990_SRC' in cur_ind_file.columns:
+        aws_ind_oids = cur_ind_file.loc[cur_ind_file['990_SRC'] == "AWS INDEX", IND_FILE_OID_COL]
+        reupl_oids = reupl_oids[~reupl_oids[IND_FILE_OID_COL].isin( aws_ind_oids )]
+    # Only forms already in the index need their old entry dropped, others are read as new forms anyway
+    reupl_oids = reupl_oids[reupl_oids[IND_FILE_OID_COL].isin( cur_ind_file[IND_FILE_OID_COL] )]
+    cur_ind_file = cur_ind_file[~cur_ind_file[IND_FILE_OID_COL].isin( reupl_oids[IND_FILE_OID_COL] )]
+
+    # Read the largest forms first so they don't hold up the end of the run
+    oid_srch_lst = new_oid_file[~new_oid_file[IND_FILE_OID_COL].isin( cur_ind_file[IND_FILE_OID_COL] )]
+    oid_srch_lst = oid_srch_lst.sort_values( MANIFEST_SIZE_COL, ascending=False )
+    oid_srch_lst = oid_srch_lst[IND_FILE_OID_COL].astype( str ).tolist()
+
+    logging.info( "Read in {} files. Reading {} Object IDs, {} re-uploaded".format( yr, len( oid_srch_lst ), len( reupl_oids ) ) )
+    return oid_srch_lst
+
+# Add newly read forms to the index, replacing older entries for re-uploaded forms, and save the changes
+def merge_yr_ind( yr, cur_ind_file, yr_ind_new, comp_dir, run_id ):
+    cur_ind_file = cur_ind_file[~cur_ind_file[IND_FILE_OID_COL].isin( yr_ind_new[IND_FILE_OID_COL] )]
+    cur_ind_file = pd.concat( [cur_ind_file, yr_ind_new], ignore_index=True )
+    save_comp_index( cur_ind_file, comp_dir, yr, run_id )
+
+# Run every step of the update for one year
+def update_yr_ind( yr, cur_ind_filename, new_oid_filename, prev_oid_filename, comp_dir, run_id, prev_comp_filename=None ):
+    cur_ind_file = read_cur_ind( yr, cur_ind_filename, comp_dir, prev_comp_filename )
+    oid_srch_lst = find_oids_to_fetch( yr, cur_ind_file, new_oid_filename, prev_oid_filename )
+    yr_ind_new = fetch_yr_ind( oid_srch_lst ) if len( oid_srch_lst ) > 0 else pd.DataFrame( columns=[IND_FILE_OID_COL] )
+    merge_yr_ind( yr, cur_ind_file, yr_ind_new, comp_dir, run_id )
 
-		# Determine the object IDs to read
-		oid_srch_lst = new_oid_file[~new_oid_file[IND_FILE_OID_COL].isin( cur_ind_file[IND_FILE_OID_COL] )]
-		oid_srch_lst = oid_srch_lst[IND_FILE_OID_COL].astype( str ).tolist()
 
-		logging.info( "Read in {} files. Reading {} Object IDs".format( yr, len( oid_srch_lst ) ) )
+#########################################
+# MAIN
+#########################################
 
-		# Fetch the information for the new index file and append it to the current one
-		if len( oid_srch_lst ) > 0:
-			cur_ind_file = cur_ind_file.append( fetch_yr_ind( oid_srch_lst ) )
 
-		# Save and print progress
-		cur_ind_file.to_csv( NEW_IND_FILE_PREF + str( yr ) + NEW_IND_FILE_SUFF, index=False )
-		logging.info( "Done with {} file".format( yr ) )
-	logging.info( "Completed." )
+if __name__ == '__main__':
 
+	if FILENAMES_NEEDED:
+		retrieve_filenames()
+
+	# Every delta saved by this update is stamped with the same run ID
+	run_id = new_run_id()
 
+	# Iterate through all years
+	yr_lst = list( range( BEGIN_YR, END_YR + 1 ) )
+	for yr in yr_lst:
+		update_yr_ind( yr, CUR_IND_FILE_PREF + str( yr ) + CUR_IND_FILE_SUFF,
+					   NEW_OID_FILE_PREF + str( yr ) + NEW_OID_FILE_SUFF,
+					   PREV_OID_FILE_PREF + str( yr ) + PREV_OID_FILE_SUFF,
+					   COMP_DIR, run_id, PREV_COMP_FILE_PREF + str( yr ) + PREV_COMP_FILE_SUFF )
+		logging.info( "Done with {} file".format( yr ) )
+	logging.info( "Completed." )